@@ -11,26 +11,178 @@ This server:
 Architecture:
 - Each client connection runs as a coroutine
 - Shared 'connected_clients' set tracks all active connections
-- Broadcasting iterates through all clients and sends messages
+- Broadcasting serializes a message once and writes it to all clients
 """
 
 import asyncio
 import websockets
-import json
+from websockets import broadcast as ws_broadcast
+from websockets.frames import Frame, prepare_data
+from websockets.protocol import State
+import orjson
 import logging
+import os
 from datetime import datetime
-from typing import Set
+import weakref
+from collections.abc import MutableSet
+from typing import Iterable, Iterator, List, Union
+
+# uvloop is a faster, libuv-based event loop (not available on Windows)
+# Fall back to the standard asyncio loop when it isn't installed
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 # Configure logging
+# Set LOG_LEVEL=WARNING in production to skip per-connection INFO logs,
+# or LOG_LEVEL=DEBUG to log every received message
+_log_level_name = (os.environ.get("LOG_LEVEL") or "INFO").upper()
+# getLevelName() maps a known name to its number, anything else to a string
+_log_level = logging.getLevelName(_log_level_name)
 logging.basicConfig(
-    level=logging.INFO,
+    level=_log_level if isinstance(_log_level, int) else logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+if not isinstance(_log_level, int):
+    logger.warning("Unknown LOG_LEVEL %r, using INFO", _log_level_name)
+
+# Number of buckets the connected clients are spread across (power of two)
+CLIENT_SHARDS = 16
+
+
+class ShardedClientSet(MutableSet):
+    """
+    Set of client connections split across CLIENT_SHARDS buckets
+    
+    Behaves like a normal set (add, discard, len, in, iteration; the -, &,
+    | and ^ operators return a plain set), but also exposes the buckets so
+    a broadcast can snapshot and write one shard at a time, yielding to the
+    event loop in between, instead of copying every client up front.
+    
+    Each shard is a WeakSet: a connection that is never unregistered (e.g.
+    an exception skipped the cleanup) is still freed once nothing else
+    references it instead of leaking forever.
+    """
+    
+    def __init__(self):
+        self.shards: List[weakref.WeakSet] = [weakref.WeakSet() for _ in range(CLIENT_SHARDS)]
+    
+    def _shard(self, websocket: websockets.WebSocketServerProtocol) -> weakref.WeakSet:
+        # Object hashes come from memory addresses, so their low bits are
+        # clustered; multiplying by the golden-ratio constant mixes them
+        # into the bits we keep (Fibonacci hashing)
+        return self.shards[(hash(websocket) * 0x9E3779B1 >> 16) & (CLIENT_SHARDS - 1)]
+    
+    def add(self, websocket: websockets.WebSocketServerProtocol):
+        self._shard(websocket).add(websocket)
+    
+    def discard(self, websocket: websockets.WebSocketServerProtocol):
+        self._shard(websocket).discard(websocket)
+    
+    def __contains__(self, websocket) -> bool:
+        return websocket in self._shard(websocket)
+    
+    def __iter__(self) -> Iterator[websockets.WebSocketServerProtocol]:
+        for shard in self.shards:
+            yield from shard
+    
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+    
+    @classmethod
+    def _from_iterable(cls, iterable) -> set:
+        # Set operators inherited from MutableSet (-, &, |, ^) build their
+        # result through this hook; return a plain set since __init__
+        # takes no iterable
+        return set(iterable)
+
 
 # Global set to track all connected clients
 # This is thread-safe in asyncio because it runs on a single thread
-connected_clients: Set[websockets.WebSocketServerProtocol] = set()
+connected_clients = ShardedClientSet()
+
+# Error reply for unparseable messages, serialized once at import time
+# so the error path does no JSON work at all
+INVALID_MSG_JSON = orjson.dumps({
+    "type": "error",
+    "message": "Invalid message format"
+}).decode()
+
+# Broadcasts to more clients than this are written in batches, yielding to
+# the event loop in between so a huge fan-out doesn't stall other clients
+BROADCAST_BATCH_SIZE = 256
+
+# Text messages starting with this tag are opaque: when the server is created
+# with raw_passthrough=True it forwards them to every client exactly as
+# received, without parsing or re-encoding JSON
+RAW_MESSAGE_TAG = "M"
+
+# Constant parts of the system messages, pre-serialized at import time
+# Only the client count and timestamp are filled in per event, so
+# connect/disconnect storms skip JSON encoding entirely
+_WELCOME_PREFIX = '{"type":"system","message":"Connected to server","client_count":'
+_JOINED_PREFIX = '{"type":"system","message":"New client joined. Total: '
+_LEFT_PREFIX = '{"type":"system","message":"Client left. Total: '
+
+
+# Module-level alias so the hot path does one global lookup, not two
+_json_dumps = orjson.dumps
+
+
+def _serialize(message: dict) -> str:
+    """
+    Serialize a message to a JSON string for a text frame
+    
+    Args:
+        message: Dictionary to encode
+    """
+    return _json_dumps(message).decode()
+
+
+def _write_frame_once(clients: Iterable[websockets.WebSocketServerProtocol], payload: Union[str, bytes],
+                      exclude: websockets.WebSocketServerProtocol = None):
+    """
+    Build one WebSocket frame and write the same bytes to every client
+    
+    ws_broadcast() still builds and copies a frame per connection; for a
+    large fan-out that is N copies of the payload. Server-to-client frames
+    are never masked (RFC 6455), so without extensions the frame bytes are
+    identical for every client and can be built once.
+    
+    Args:
+        clients: Connections to write to
+        payload: Message to send (str = text frame, bytes = binary frame)
+        exclude: Optional websocket to skip
+    
+    Technical Details:
+    - Skips connections that aren't open, like ws_broadcast()
+    - Clients with negotiated extensions need a frame encoded for their own
+      extension state, so they fall back to ws_broadcast() (the server
+      disables compression, so normally none do)
+    - The server never sends fragmented messages, so a raw frame can't be
+      interleaved into the middle of one
+    """
+    opcode, data = prepare_data(payload)
+    frame = Frame(opcode, data).serialize(mask=False)
+    
+    with_extensions = []
+    for client in clients:
+        if client is exclude or client.state is not State.OPEN:
+            continue
+        if client.extensions:
+            with_extensions.append(client)
+            continue
+        try:
+            client.transport.write(frame)
+        except Exception as e:
+            # Same policy as ws_broadcast(): one failed write doesn't stop
+            # the others, and the client's handler cleans up on close
+            logger.debug("Failed to write broadcast frame: %s", e)
+    
+    if with_extensions:
+        ws_broadcast(with_extensions, payload)
 
 
 class WebSocketServer:
@@ -43,17 +195,24 @@ class WebSocketServer:
     - Connection lifecycle
     """
     
-    def __init__(self, host: str = "0.0.0.0", port: int = 8765):
+    def __init__(self, host: str = "0.0.0.0", port: int = 8765, raw_passthrough: bool = False):
         """
         Initialize server configuration
         
         Args:
             host: Server host (0.0.0.0 = all interfaces)
             port: Server port
+            raw_passthrough: Forward "M"-tagged text messages verbatim
+                (off by default - the tutorial clients only speak JSON)
         """
         self.host = host
         self.port = port
+        self.raw_passthrough = raw_passthrough
         self.connected_clients = connected_clients
+        # Held while a broadcast writes to clients, so a broadcast that yields
+        # between batches can't be overtaken by a later one - every client
+        # sees messages in the same order
+        self._broadcast_lock = asyncio.Lock()
     
     async def register_client(self, websocket: websockets.WebSocketServerProtocol):
         """
@@ -64,23 +223,24 @@ class WebSocketServer:
         """
         self.connected_clients.add(websocket)
         client_count = len(self.connected_clients)
-        logger.info(f"Client connected. Total clients: {client_count}")
+        logger.info("Client connected. Total clients: %d", client_count)
+        
+        # One timestamp for both the welcome and the join notification
+        now_iso = datetime.now().isoformat()
         
         # Send welcome message to the new client
-        welcome_msg = {
-            "type": "system",
-            "message": "Connected to server",
-            "timestamp": datetime.now().isoformat(),
-            "client_count": client_count
-        }
-        await websocket.send(json.dumps(welcome_msg))
+        welcome_msg = (
+            _WELCOME_PREFIX + str(client_count) +
+            ',"timestamp":"' + now_iso + '"}'
+        )
+        await websocket.send(welcome_msg)
         
         # Notify all other clients
-        await self.broadcast({
-            "type": "system",
-            "message": f"New client joined. Total: {client_count}",
-            "timestamp": datetime.now().isoformat()
-        }, exclude=websocket)
+        await self.broadcast_raw(
+            _JOINED_PREFIX + str(client_count) +
+            '","timestamp":"' + now_iso + '"}',
+            exclude=websocket
+        )
     
     async def unregister_client(self, websocket: websockets.WebSocketServerProtocol):
         """
@@ -91,14 +251,13 @@ class WebSocketServer:
         """
         self.connected_clients.discard(websocket)
         client_count = len(self.connected_clients)
-        logger.info(f"Client disconnected. Total clients: {client_count}")
+        logger.info("Client disconnected. Total clients: %d", client_count)
         
         # Notify remaining clients
-        await self.broadcast({
-            "type": "system",
-            "message": f"Client left. Total: {client_count}",
-            "timestamp": datetime.now().isoformat()
-        })
+        await self.broadcast_raw(
+            _LEFT_PREFIX + str(client_count) +
+            '","timestamp":"' + datetime.now().isoformat() + '"}'
+        )
     
     async def broadcast(self, message: dict, exclude: websockets.WebSocketServerProtocol = None):
         """
@@ -109,51 +268,72 @@ class WebSocketServer:
             exclude: Optional websocket to exclude from broadcast
         
         Technical Details:
-        - Uses asyncio.gather() for concurrent sending
-        - Handles disconnections gracefully
-        - Non-blocking operation
+        - Serializes the message once and shares the payload with every client
+        - Builds one WebSocket frame and writes the same bytes straight to
+          each connection - no task or per-client framing
+        - Skips connections that are closing or closed
+        - Frame writes are queued on each transport without waiting for the
+          network; a large fan-out yields to the event loop between batches
+        
+        Note: websockets sends str as a text frame and bytes as a binary
+        frame. Our clients expect text, so the payload stays a str; it is
+        UTF-8 encoded only once, when the shared frame is built.
         """
         if not self.connected_clients:
             logger.warning("No clients connected for broadcast")
             return
         
-        # Convert message to JSON
-        message_json = json.dumps(message)
+        # Convert message to JSON exactly once, however many clients there are
+        # orjson serializes in C; decode() keeps it a text frame, which is
+        # what the Android and browser clients expect
+        await self.broadcast_raw(_serialize(message), exclude)
+    
+    async def broadcast_raw(self, payload: Union[str, bytes], exclude: websockets.WebSocketServerProtocol = None):
+        """
+        Broadcast an already-serialized message to all connected clients
         
-        # Create list of send coroutines
-        # We filter out the excluded client if specified
-        send_tasks = []
-        for client in self.connected_clients:
-            if client != exclude:
-                send_tasks.append(self.send_to_client(client, message_json))
+        Args:
+            payload: Message to send as-is (str = text frame, bytes = binary frame)
+            exclude: Optional websocket to exclude from broadcast
+        """
+        if not self.connected_clients:
+            logger.warning("No clients connected for broadcast")
+            return
         
-        # Send to all clients concurrently
-        if send_tasks:
-            # gather() runs all coroutines concurrently
-            # return_exceptions=True prevents one failure from stopping others
-            results = await asyncio.gather(*send_tasks, return_exceptions=True)
-            
-            # Log any errors
-            for i, result in enumerate(results):
-                if isinstance(result, Exception):
-                    logger.error(f"Broadcast error: {result}")
+        # One fan-out at a time; waiting broadcasts are released in FIFO order
+        # The lock is acquired without yielding when no broadcast is running
+        async with self._broadcast_lock:
+            await self._write_to_clients(payload, exclude)
     
-    async def send_to_client(self, websocket: websockets.WebSocketServerProtocol, message: str):
+    async def _write_to_clients(self, payload: Union[str, bytes], exclude: websockets.WebSocketServerProtocol = None):
         """
-        Send a message to a specific client with error handling
+        Write a payload to every connected client (call with the broadcast lock held)
         
         Args:
-            websocket: Target client connection
-            message: JSON string to send
+            payload: Message to send as-is
+            exclude: Optional websocket to exclude from broadcast
         """
-        try:
-            await websocket.send(message)
-        except websockets.exceptions.ConnectionClosed:
-            logger.warning("Attempted to send to closed connection")
-            # Remove from connected clients
-            self.connected_clients.discard(websocket)
-        except Exception as e:
-            logger.error(f"Error sending to client: {e}")
+        # Write the same frame bytes to every client
+        # Failed writes are ignored; the client's handler cleans up on close
+        if len(self.connected_clients) <= BROADCAST_BATCH_SIZE:
+            # Nothing yields before the write finishes, so the live set can be
+            # walked directly - no snapshot needed
+            _write_frame_once(self.connected_clients, payload, exclude)
+            return
+        
+        # Large fan-out - go shard by shard, yielding after each batch so
+        # incoming messages and pings keep being processed
+        # - Each shard is snapshotted only when its turn comes, so the copy
+        #   work is spread out too, and the snapshot stays valid if clients
+        #   connect/disconnect while we yield
+        # - Clients that disconnect mid-broadcast are skipped by the writer
+        # Bind globals to locals once - the loop can run thousands of times
+        write, sleep, batch_size = _write_frame_once, asyncio.sleep, BROADCAST_BATCH_SIZE
+        for shard in self.connected_clients.shards:
+            targets = tuple(shard)
+            for start in range(0, len(targets), batch_size):
+                write(targets[start:start + batch_size], payload, exclude)
+                await sleep(0)
     
     async def handle_client(self, websocket: websockets.WebSocketServerProtocol, path: str):
         """
@@ -169,46 +349,63 @@ class WebSocketServer:
         Flow:
         1. Register client
         2. Listen for messages in loop
-        3. Broadcast received messages
+        3. Broadcast received messages (opaque "M" messages verbatim,
+           if raw_passthrough is enabled)
         4. Unregister on disconnect
         """
         # Register the client
         await self.register_client(websocket)
         
+        # Bind attribute and global lookups to locals once per connection
+        # instead of resolving them again for every message
+        is_enabled_for, debug = logger.isEnabledFor, logger.debug
+        loads, now, broadcast = orjson.loads, datetime.now, self.broadcast
+        raw_passthrough = self.raw_passthrough
+        
         try:
             # Keep listening for messages until connection closes
             async for message in websocket:
-                logger.info(f"Received message: {message}")
+                # Logged on every message - keep it at DEBUG and only format
+                # the payload when DEBUG is actually enabled
+                if is_enabled_for(logging.DEBUG):
+                    debug("Received message: %s", message)
                 
                 try:
+                    # Opaque message - forward the frame untouched, no JSON work
+                    # Text frames only; binary frames are never passed through
+                    if (raw_passthrough and isinstance(message, str)
+                            and message.startswith(RAW_MESSAGE_TAG)):
+                        await self.broadcast_raw(message)
+                        continue
+                    
                     # Parse incoming message
-                    data = json.loads(message)
+                    data = loads(message)
+                    
+                    # Timestamp once per message; broadcast() reuses the
+                    # serialized envelope for every client
+                    now_iso = now().isoformat()
                     
                     # Create broadcast message with metadata
                     broadcast_msg = {
                         "type": "message",
                         "content": data.get("content", ""),
                         "sender": data.get("sender", "anonymous"),
-                        "timestamp": datetime.now().isoformat()
+                        "timestamp": now_iso
                     }
                     
                     # Broadcast to all clients (including sender)
-                    await self.broadcast(broadcast_msg)
+                    await broadcast(broadcast_msg)
                     
-                except json.JSONDecodeError:
-                    logger.error(f"Invalid JSON received: {message}")
-                    error_msg = {
-                        "type": "error",
-                        "message": "Invalid message format"
-                    }
-                    await websocket.send(json.dumps(error_msg))
+                except orjson.JSONDecodeError:
+                    logger.error("Invalid JSON received: %s", message)
+                    await websocket.send(INVALID_MSG_JSON)
                 except Exception as e:
-                    logger.error(f"Error processing message: {e}")
+                    logger.error("Error processing message: %s", e)
         
         except websockets.exceptions.ConnectionClosed:
             logger.info("Client connection closed normally")
         except Exception as e:
-            logger.error(f"Error in client handler: {e}")
+            logger.error("Error in client handler: %s", e)
         finally:
             # Always unregister client on disconnect
             await self.unregister_client(websocket)
@@ -223,7 +420,7 @@ class WebSocketServer:
         - Spawns handle_client coroutine for each connection
         - Runs until interrupted
         """
-        logger.info(f"Starting WebSocket server on {self.host}:{self.port}")
+        logger.info("Starting WebSocket server on %s:%d", self.host, self.port)
         
         # Start server
         # serve() creates a server and handles accepting connections
@@ -233,9 +430,13 @@ class WebSocketServer:
             self.port,
             # Optional: configure ping/pong for connection keepalive
             ping_interval=30,  # Send ping every 30 seconds
-            ping_timeout=10    # Wait 10 seconds for pong
+            ping_timeout=10,   # Wait 10 seconds for pong
+            # Disable permessage-deflate: compressing small JSON messages
+            # costs more CPU than it saves, and a per-connection compressor
+            # means a broadcast frame can't be built once for everyone
+            compression=None
         ):
-            logger.info(f"Server running on ws://{self.host}:{self.port}")
+            logger.info("Server running on ws://%s:%d", self.host, self.port)
             # Keep server running
             await asyncio.Future()  # Run forever
 
@@ -250,9 +451,12 @@ async def main():
 
 if __name__ == "__main__":
     try:
-        # Run the async main function
-        asyncio.run(main())
+        # Run the async main function, on uvloop's event loop when available
+        if uvloop is not None:
+            uvloop.run(main())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Server stopped by user")
     except Exception as e:
-        logger.error(f"Server error: {e}")
\ No newline at end of file
+        logger.error("Server error: %s", e)
\ No newline at end of file